@@ -28,13 +28,20 @@ Gemini 音頻轉錄器 - 使用 Google Gemini 進行音頻轉錄
 """
 
 import os
+import csv
 import json
+import atexit
 import logging
+import logging.handlers
 import asyncio
-import base64
+import queue
+import random
+import shutil
+import struct
+import subprocess
+import tempfile
 from pathlib import Path
-from typing import List, Optional, Dict, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Dict, Tuple, AsyncIterator, Iterator
 import time
 
 # 加載環境變數
@@ -45,20 +52,92 @@ except ImportError:
     # 如果沒有安裝 python-dotenv，使用系統環境變數
     pass
 
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('gemini_transcribe.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+# 加載 Google GenAI（模塊加載時即檢查，讓缺少依賴的問題儘早暴露）
+try:
+    from google import genai
+    from google.genai import types
+except ImportError:
+    genai = None
+    types = None
+
+# 配置日誌：記錄先放入隊列，由後台線程寫入文件和終端，避免事件循環被 I/O 阻塞
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler('gemini_transcribe.log', encoding='utf-8'),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+# 監聽線程在導入時啟動，程序退出時停止並寫出隊列中剩餘的記錄
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# 根日誌器只掛隊列處理器；記錄在後台線程中按上面的格式輸出
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_root_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
 logger = logging.getLogger(__name__)
 
+# 音頻擴展名對應的 MIME 類型
+_MIME_TYPES = {
+    '.mp3': 'audio/mpeg',
+    '.wav': 'audio/wav',
+    '.m4a': 'audio/mp4',
+    '.flac': 'audio/flac',
+    '.aac': 'audio/aac',
+    '.ogg': 'audio/ogg',
+    '.webm': 'audio/webm',
+    '.m4v': 'audio/mp4'
+}
+
+class AsyncRateLimiter:
+    """異步令牌桶限速器，限制單位時間內的請求數量"""
+
+    def __init__(self, max_rate: float, time_period: float = 60.0):
+        """
+        初始化限速器
+
+        Args:
+            max_rate: 每個時間週期內允許的最大請求數
+            time_period: 時間週期（秒）
+        """
+        self.max_rate = max_rate
+        self.time_period = time_period
+        self._tokens = max_rate
+        self._last_refill = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self) -> None:
+        """按經過的時間補充令牌"""
+        now = time.monotonic()
+        elapsed = now - self._last_refill
+        self._last_refill = now
+        self._tokens = min(self.max_rate, self._tokens + elapsed * self.max_rate / self.time_period)
+
+    async def __aenter__(self):
+        # 持有鎖等待，讓請求按先來後到的順序獲得令牌
+        async with self._lock:
+            while True:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return self
+                await asyncio.sleep((1 - self._tokens) * self.time_period / self.max_rate)
+
+    async def __aexit__(self, exc_type, exc, tb):
+        return False
+
 class GeminiTranscriber:
     """Gemini 音頻轉錄器類"""
 
+    # 支援的音頻格式
+    audio_extensions = frozenset({'.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.webm', '.m4v'})
+    # 不含點號的擴展名，用於掃描時直接比對文件名後綴
+    _audio_suffixes = frozenset(ext.lstrip('.') for ext in audio_extensions)
+
     def __init__(self, audio_dir: str = "下載資料夾"):
         """
         初始化轉錄器
@@ -69,19 +148,31 @@ class GeminiTranscriber:
         self.audio_dir = Path(audio_dir)
         self.audio_dir.mkdir(exist_ok=True)
 
-        # 支援的音頻格式
-        self.audio_extensions = {'.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.webm', '.m4v'}
-
         # Gemini 配置
         self.model_name = "gemini-2.0-flash-exp"  # 使用支持音頻的模型
         self.max_segment_duration = 30 * 60  # 30分鐘，單位為秒
         self.max_workers = 5  # 並行處理的最大數量
+        self.max_upload_bytes = 2 * 1024 ** 3  # File API 單個文件大小上限 (2GB)
+        self._sem: Optional[asyncio.Semaphore] = None  # 在事件循環內延遲創建
+        self._sem_loop: Optional[asyncio.AbstractEventLoop] = None
+
+        # 每分鐘最大請求數，主動限速以避免觸發 429 後集體重試
+        self.requests_per_minute = float(os.environ.get("GEMINI_RPM", "15"))
+        if self.requests_per_minute <= 0:
+            raise ValueError("環境變數 GEMINI_RPM 必須大於 0")
+        self._rate_limiter: Optional[AsyncRateLimiter] = None  # 在事件循環內延遲創建
+        self._rate_limiter_loop: Optional[asyncio.AbstractEventLoop] = None
 
         # API 配置
         self.api_key = os.environ.get("GEMINI_API_KEY")
         if not self.api_key:
             raise ValueError("請設置環境變數 GEMINI_API_KEY")
 
+        # 創建共用客戶端，所有區塊共享同一個連接池
+        if genai is None:
+            raise ImportError("google-genai 模塊未安裝，請先安裝: pip install google-genai")
+        self._client = genai.Client(api_key=self.api_key)
+
         # 重試配置
         self.max_retries = 3
         self.retry_delay = 2  # 秒
@@ -102,21 +193,45 @@ class GeminiTranscriber:
 請確保轉錄的準確性和完整性。
 """
 
-    def find_audio_files(self) -> List[Path]:
+    def find_audio_files(self) -> List[Tuple[Path, bool]]:
         """
-        遞歸查找所有音頻文件
+        遞歸查找所有音頻文件，並在同一次遍歷中判斷是否需要轉錄
 
         Returns:
-            音頻文件路徑列表
+            (音頻文件路徑, 是否需要轉錄) 元組列表
         """
         audio_files = []
+        pending_dirs = [self.audio_dir]
+
+        # 使用 os.scandir 逐層遍歷，每個目錄只讀取一次
+        while pending_dirs:
+            current_dir = pending_dirs.pop()
+            file_names = set()
+            audio_entries = []
 
-        # 遞歸遍歷所有文件
-        for file_path in self.audio_dir.rglob('*'):
-            if (file_path.is_file() and
-                file_path.suffix.lower() in self.audio_extensions and
-                not file_path.name.startswith('.')):  # 過濾隱藏文件
-                audio_files.append(file_path)
+            try:
+                with os.scandir(current_dir) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            pending_dirs.append(entry.path)
+                            continue
+
+                        file_names.add(entry.name)
+                        # 先用文件名過濾，非音頻文件不構造 Path 也不做額外檢查
+                        if (not entry.name.startswith('.') and  # 過濾隱藏文件
+                            '.' in entry.name and
+                            entry.name.rpartition('.')[2].lower() in self._audio_suffixes and
+                            entry.is_file()):
+                            audio_entries.append(entry)
+            except OSError as e:
+                logger.warning(f"無法讀取目錄 {current_dir}: {e}")
+                continue
+
+            # 根據同目錄的文件名集合判斷轉錄文件是否存在，無需逐個 stat
+            for entry in audio_entries:
+                audio_path = Path(entry.path)
+                transcript_name = self.get_transcript_path(audio_path).name
+                audio_files.append((audio_path, transcript_name not in file_names))
 
         return audio_files
 
@@ -132,153 +247,344 @@ class GeminiTranscriber:
         """
         return audio_path.with_suffix('.txt')
 
-    def needs_transcription(self, audio_path: Path) -> bool:
+    async def split_audio_file(self, audio_path: Path,
+                               output_dir: Path) -> AsyncIterator[Tuple[Path, float, float]]:
         """
-        檢查音頻文件是否需要轉錄
+        如果音頻超過30分鐘，分割成多個區塊
+
+        先從文件頭讀取時長，不超過區塊上限時直接使用原始文件，不啟動分割。
+        需要分割時使用 ffmpeg 的 segment 封裝器一次性輸出所有區塊，只需讀取原始文件一次；
+        各區塊的時間範圍直接取自 ffmpeg 輸出的區塊列表。
+        每個區塊寫入完成後立即產出，調用者可在 ffmpeg 繼續分割的同時開始上傳
 
         Args:
             audio_path: 音頻文件路徑
+            output_dir: 分割文件的輸出目錄
 
-        Returns:
-            如果需要轉錄則返回 True
+        Yields:
+            分割後的區塊，每個元組包含 (文件路徑, 開始時間, 結束時間)
+
+        Raises:
+            RuntimeError: ffmpeg 分割失敗
         """
-        transcript_path = self.get_transcript_path(audio_path)
-        return not transcript_path.exists()
+        # WAV 文件可直接從文件頭計算時長並按字節切分，無需調用 ffmpeg
+        if audio_path.suffix.lower() == '.wav':
+            wav_info = await asyncio.to_thread(self._read_wav_info, audio_path)
+            if wav_info:
+                wav_segments = self._iter_wav_segments(audio_path, wav_info, output_dir)
+                while True:
+                    segment = await asyncio.to_thread(next, wav_segments, None)
+                    if segment is None:
+                        return
+                    yield segment
+
+        # 時長在區塊上限內時無需分割（無法獲取時長時交由 ffmpeg 分割判斷）
+        duration = await self._probe_duration(audio_path)
+        if duration is not None and self._can_upload_whole(audio_path, duration):
+            yield (audio_path, 0.0, duration)
+            return
 
-    def get_audio_duration(self, audio_path: Path) -> float:
+        suffix = audio_path.suffix
+        segment_pattern = output_dir / f"%03d{suffix}"
+        segment_list = output_dir / "segments.csv"
+        segment_list.unlink(missing_ok=True)
+
+        cmd = [
+            'ffmpeg',
+            '-hide_banner',
+            '-loglevel', 'error',  # 只輸出錯誤，避免管道被大量日誌填滿
+            '-nostdin',
+            '-i', str(audio_path),
+            '-map', '0:a',
+            '-threads', '1',  # 複製編碼受限於磁盤 I/O，多線程無益
+            '-f', 'segment',
+            '-segment_time', str(self.max_segment_duration),
+            '-segment_start_number', '1',
+            '-segment_list', str(segment_list),
+            '-segment_list_type', 'csv',  # 每行: 文件名,開始時間,結束時間；區塊寫完後才追加
+            '-reset_timestamps', '1',
+            '-avoid_negative_ts', 'make_zero',
+            '-c', 'copy',  # 複製編碼，無需重新編碼
+            '-y',  # 覆蓋輸出文件
+            str(segment_pattern)
+        ]
+
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE
+        )
+        stderr_task = asyncio.create_task(process.stderr.read())
+        wait_task = asyncio.create_task(process.wait())
+
+        list_offset = 0
+        first_segment = None
+        segment_count = 0
+
+        try:
+            while True:
+                # 等待 ffmpeg 結束，期間每 0.5 秒檢查一次區塊列表
+                await asyncio.wait({wait_task}, timeout=0.5)
+                finished = wait_task.done()
+
+                new_segments, list_offset = self._read_segment_list(segment_list, list_offset)
+                for segment in new_segments:
+                    segment_count += 1
+                    if segment_count == 1:
+                        # 暫緩產出第一個區塊，直到確認文件確實需要分割
+                        first_segment = segment
+                        continue
+                    if first_segment:
+                        logger.info(f"創建分割文件: {first_segment[0]}")
+                        yield first_segment
+                        first_segment = None
+                    logger.info(f"創建分割文件: {segment[0]}")
+                    yield segment
+
+                if finished:
+                    break
+
+            stderr = await stderr_task
+            if process.returncode != 0:
+                raise RuntimeError(f"分割音頻失敗: {stderr.decode('utf-8', 'replace').strip()}")
+
+            if segment_count == 1:
+                # 只產生一個區塊，說明不需要分割：刪除副本，直接使用原始文件
+                segment_path, _, end_time = first_segment
+                if segment_path != audio_path:
+                    segment_path.unlink(missing_ok=True)
+                yield (audio_path, 0.0, end_time)
+                return
+
+            logger.info(f"音頻文件 {audio_path} 被分割為 {segment_count} 個區塊")
+
+        finally:
+            if not wait_task.done():
+                process.kill()
+                await wait_task
+            if not stderr_task.done():
+                stderr_task.cancel()
+            segment_list.unlink(missing_ok=True)
+
+    async def _probe_duration(self, audio_path: Path) -> Optional[float]:
         """
-        獲取音頻文件時長（秒）
+        使用 ffprobe 從文件頭讀取音頻時長（不解碼音頻數據）
 
         Args:
             audio_path: 音頻文件路徑
 
         Returns:
-            音頻時長（秒）
+            音頻時長（秒），如果無法獲取則返回None
         """
         try:
-            # 使用 ffprobe 獲取音頻信息
-            import subprocess
-
-            cmd = [
+            process = await asyncio.create_subprocess_exec(
                 'ffprobe',
-                '-v', 'quiet',
-                '-print_format', 'json',
-                '-show_format',
-                str(audio_path)
-            ]
-
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                data = json.loads(result.stdout)
-                duration = float(data['format']['duration'])
-                return duration
-            else:
-                logger.warning(f"無法獲取音頻時長: {audio_path}")
-                return 0.0
+                '-hide_banner',
+                '-loglevel', 'error',
+                '-show_entries', 'format=duration',
+                '-of', 'default=noprint_wrappers=1:nokey=1',
+                str(audio_path),
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            stdout, stderr = await process.communicate()
+            if process.returncode != 0:
+                logger.warning(f"無法獲取音頻時長: {audio_path} {stderr.decode('utf-8', 'replace').strip()}")
+                return None
+            return float(stdout.decode('utf-8', 'replace').strip())
 
         except Exception as e:
-            logger.error(f"獲取音頻時長失敗 {audio_path}: {e}")
-            return 0.0
+            logger.warning(f"獲取音頻時長失敗 {audio_path}: {e}")
+            return None
 
-    def split_audio_file(self, audio_path: Path) -> List[Tuple[Path, float, float]]:
+    def _read_segment_list(self, segment_list: Path, offset: int) -> Tuple[List[Tuple[Path, float, float]], int]:
         """
-        如果音頻超過30分鐘，分割成多個區塊
+        讀取 ffmpeg 區塊列表中新增的完整行
 
         Args:
-            audio_path: 音頻文件路徑
+            segment_list: ffmpeg 輸出的 CSV 區塊列表路徑
+            offset: 上次讀取結束的位置（字節）
 
         Returns:
-            分割後的文件列表，每個元組包含 (文件路徑, 開始時間, 結束時間)
+            (新增的區塊列表, 新的讀取位置)
         """
-        duration = self.get_audio_duration(audio_path)
-
-        if duration <= self.max_segment_duration:
-            # 不需要分割
-            return [(audio_path, 0.0, duration)]
-
-        # 需要分割
+        try:
+            with open(segment_list, 'rb') as f:
+                f.seek(offset)
+                data = f.read()
+        except FileNotFoundError:
+            return [], offset
+
+        # 只處理以換行結尾的完整行，未寫完的行留到下次讀取
+        complete = data[:data.rfind(b'\n') + 1]
         segments = []
-        current_time = 0.0
+        for row in csv.reader(complete.decode('utf-8').splitlines()):
+            if len(row) < 3:
+                continue
+            segment_path = segment_list.parent / Path(row[0]).name
+            segments.append((segment_path, float(row[1]), float(row[2])))
 
-        while current_time < duration:
-            end_time = min(current_time + self.max_segment_duration, duration)
-            segment_path = self._create_segment_file(audio_path, current_time, end_time)
+        return segments, offset + len(complete)
 
-            if segment_path:
-                segments.append((segment_path, current_time, end_time))
+    def _can_upload_whole(self, audio_path: Path, duration: float) -> bool:
+        """
+        檢查音頻文件是否可以整個上傳，無需分割
 
-            current_time = end_time
+        Args:
+            audio_path: 音頻文件路徑
+            duration: 音頻時長（秒）
 
-        logger.info(f"音頻文件 {audio_path} 被分割為 {len(segments)} 個區塊")
-        return segments
+        Returns:
+            如果時長和文件大小都在單次請求限制內則返回 True
+        """
+        return (duration <= self.max_segment_duration and
+                audio_path.stat().st_size <= self.max_upload_bytes)
 
-    def _create_segment_file(self, audio_path: Path, start_time: float, end_time: float) -> Optional[Path]:
+    def _read_wav_info(self, audio_path: Path) -> Optional[Dict]:
         """
-        創建音頻分割文件
+        解析 WAV 文件頭，獲取格式區塊及音頻數據的位置
 
         Args:
-            audio_path: 原始音頻文件路徑
-            start_time: 開始時間（秒）
-            end_time: 結束時間（秒）
+            audio_path: WAV 文件路徑
 
         Returns:
-            分割後的文件路徑，如果失敗則返回 None
+            包含 fmt 區塊內容、數據偏移、數據大小、字節率和塊對齊的字典，
+            如果不是可解析的 PCM WAV 文件則返回 None
         """
         try:
-            # 生成分割文件名
-            stem = audio_path.stem
-            suffix = audio_path.suffix
-            segment_index = int(start_time // self.max_segment_duration) + 1
-            segment_name = f"{segment_index:03d}{suffix}"
-
-            segment_path = audio_path.parent / segment_name
-
-            # 使用 ffmpeg 進行音頻分割
-            import subprocess
-
-            cmd = [
-                'ffmpeg',
-                '-i', str(audio_path),
-                '-ss', str(start_time),
-                '-t', str(end_time - start_time),
-                '-c', 'copy',  # 複製編碼，無需重新編碼
-                '-y',  # 覆蓋輸出文件
-                str(segment_path)
-            ]
+            with open(audio_path, 'rb') as f:
+                riff, _, wave = struct.unpack('<4sI4s', f.read(12))
+                if riff != b'RIFF' or wave != b'WAVE':
+                    return None
+
+                fmt_chunk = None
+                while True:
+                    header = f.read(8)
+                    if len(header) < 8:
+                        return None
+
+                    chunk_id, chunk_size = struct.unpack('<4sI', header)
+                    if chunk_id == b'fmt ':
+                        fmt_chunk = f.read(chunk_size)
+                        f.seek(chunk_size % 2, os.SEEK_CUR)  # 區塊按偶數字節對齊
+                    elif chunk_id == b'data':
+                        data_offset = f.tell()
+                        break
+                    else:
+                        f.seek(chunk_size + chunk_size % 2, os.SEEK_CUR)
 
-            result = subprocess.run(cmd, capture_output=True, text=True)
-            if result.returncode == 0:
-                logger.info(f"創建分割文件: {segment_path}")
-                return segment_path
-            else:
-                logger.error(f"分割音頻失敗: {result.stderr}")
+            if not fmt_chunk or len(fmt_chunk) < 16:
                 return None
 
-        except Exception as e:
-            logger.error(f"創建分割文件失敗: {e}")
+            _, _, _, byte_rate, block_align = struct.unpack('<HHIIH', fmt_chunk[:14])
+            if byte_rate == 0 or block_align == 0:
+                return None
+
+            # 流式寫入的 WAV 可能在頭中記錄錯誤的數據大小，以實際文件大小為準
+            data_size = min(chunk_size, audio_path.stat().st_size - data_offset)
+
+            return {
+                'fmt': fmt_chunk,
+                'data_offset': data_offset,
+                'data_size': data_size,
+                'byte_rate': byte_rate,
+                'block_align': block_align
+            }
+
+        except (OSError, struct.error) as e:
+            logger.warning(f"解析 WAV 文件頭失敗 {audio_path}: {e}")
             return None
 
-    def encode_audio_to_base64(self, audio_path: Path) -> Optional[str]:
+    def _iter_wav_segments(self, audio_path: Path, wav_info: Dict,
+                           output_dir: Path) -> Iterator[Tuple[Path, float, float]]:
         """
-        將音頻文件編碼為 base64 字符串
+        按字節偏移切分 WAV 文件，為每個區塊重寫文件頭
 
         Args:
-            audio_path: 音頻文件路徑
+            audio_path: WAV 文件路徑
+            wav_info: _read_wav_info 返回的文件頭信息
+            output_dir: 分割文件的輸出目錄
 
-        Returns:
-            base64 編碼的字符串，如果失敗則返回 None
+        Yields:
+            每個區塊寫入完成後產出 (文件路徑, 開始時間, 結束時間)
         """
-        try:
-            with open(audio_path, 'rb') as f:
-                audio_data = f.read()
+        byte_rate = wav_info['byte_rate']
+        block_align = wav_info['block_align']
+        data_size = wav_info['data_size']
+        fmt_chunk = wav_info['fmt']
+        fmt_padding = b'\x00' * (len(fmt_chunk) % 2)
+        duration = data_size / byte_rate
+
+        if self._can_upload_whole(audio_path, duration):
+            # 不需要分割
+            yield (audio_path, 0.0, duration)
+            return
+
+        # 每個區塊的字節數，對齊到完整的採樣幀
+        segment_bytes = self.max_segment_duration * byte_rate // block_align * block_align
+        buffer_size = 1024 * 1024
+
+        segment_count = 0
+        with open(audio_path, 'rb') as src:
+            offset = 0
+            while offset < data_size:
+                length = min(segment_bytes, data_size - offset)
+                segment_path = output_dir / f"{segment_count + 1:03d}{audio_path.suffix}"
+                data_padding = b'\x00' * (length % 2)
+
+                header = b''.join([
+                    b'RIFF',
+                    struct.pack('<I', 4 + 8 + len(fmt_chunk) + len(fmt_padding) + 8 + length + len(data_padding)),
+                    b'WAVE',
+                    b'fmt ',
+                    struct.pack('<I', len(fmt_chunk)),
+                    fmt_chunk,
+                    fmt_padding,
+                    b'data',
+                    struct.pack('<I', length)
+                ])
+
+                src.seek(wav_info['data_offset'] + offset)
+                with open(segment_path, 'wb') as dst:
+                    dst.write(header)
+                    remaining = length
+                    while remaining > 0:
+                        chunk = src.read(min(buffer_size, remaining))
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        remaining -= len(chunk)
+                    dst.write(data_padding)
+
+                start_time = offset / byte_rate
+                end_time = (offset + length) / byte_rate
+                segment_count += 1
+                logger.info(f"創建分割文件: {segment_path}")
+                yield (segment_path, start_time, end_time)
+                offset += length
 
-            # 將音頻數據編碼為 base64
-            encoded_audio = base64.b64encode(audio_data).decode('utf-8')
-            return encoded_audio
+        logger.info(f"音頻文件 {audio_path} 被分割為 {segment_count} 個區塊")
 
-        except Exception as e:
-            logger.error(f"編碼音頻文件失敗 {audio_path}: {e}")
-            return None
+    def _upload_file(self, audio_path: Path, mime_type: str):
+        """
+        通過 File API 上傳音頻文件
+
+        傳入已打開的文件對象，由 SDK 分塊讀取並發送，無需預先將整個文件讀入內存
+
+        Args:
+            audio_path: 音頻文件路徑
+            mime_type: MIME 類型
+
+        Returns:
+            上傳後的文件對象（包含 name 和 uri）
+        """
+        with open(audio_path, 'rb') as f:
+            return self._client.files.upload(
+                file=f,
+                config=types.UploadFileConfig(mime_type=mime_type)
+            )
 
     async def transcribe_segment_async(self, segment_info: Tuple[Path, float, float]) -> Optional[Dict]:
         """
@@ -295,47 +601,44 @@ class GeminiTranscriber:
         try:
             logger.info(f"開始轉錄區塊: {segment_path} ({start_time:.1f}s - {end_time:.1f}s)")
 
-            # 編碼音頻
-            encoded_audio = self.encode_audio_to_base64(segment_path)
-            if not encoded_audio:
-                return None
+            # 通過 File API 上傳音頻，請求中只引用文件 URI
+            mime_type = self._get_mime_type(segment_path)
+            uploaded = await asyncio.to_thread(self._upload_file, segment_path, mime_type)
 
-            # 動態導入 Google GenAI
             try:
-                from google import genai
-                from google.genai import types
-            except ImportError:
-                raise ImportError("google-genai 模塊未安裝，請先安裝: pip install google-genai")
-
-            # 創建客戶端
-            client = genai.Client(api_key=self.api_key)
-
-            # 準備請求內容
-            contents = [
-                types.Content(
-                    role="user",
-                    parts=[
-                        types.Part.from_text(text=self.transcription_prompt),
-                        types.Part.from_bytes(
-                            data=base64.b64decode(encoded_audio),
-                            mime_type=self._get_mime_type(segment_path)
-                        ),
-                    ],
-                ),
-            ]
-
-            # 配置生成參數
-            generate_content_config = types.GenerateContentConfig(
-                temperature=0.1,  # 低溫以獲得更確定性的輸出
-                thinking_config=types.ThinkingConfig(
-                    thinking_budget=0,
-                ),
-            )
-
-            # 調用 API (帶重試機制)
-            full_text = self._call_gemini_api_with_retry(
-                client, self.model_name, contents, generate_content_config
-            )
+                # 準備請求內容
+                contents = [
+                    types.Content(
+                        role="user",
+                        parts=[
+                            types.Part.from_text(text=self.transcription_prompt),
+                            types.Part.from_uri(
+                                file_uri=uploaded.uri,
+                                mime_type=mime_type
+                            ),
+                        ],
+                    ),
+                ]
+
+                # 配置生成參數
+                generate_content_config = types.GenerateContentConfig(
+                    temperature=0.1,  # 低溫以獲得更確定性的輸出
+                    thinking_config=types.ThinkingConfig(
+                        thinking_budget=0,
+                    ),
+                )
+
+                # 調用 API (帶重試機制)
+                full_text = await self._call_gemini_api_with_retry(
+                    self.model_name, contents, generate_content_config
+                )
+
+            finally:
+                # 刪除已上傳的文件，避免佔用配額
+                try:
+                    await asyncio.to_thread(self._client.files.delete, name=uploaded.name)
+                except Exception as e:
+                    logger.warning(f"刪除已上傳文件失敗 {uploaded.name}: {e}")
 
             if not full_text:
                 logger.warning(f"API 返回空內容: {segment_path}")
@@ -357,12 +660,41 @@ class GeminiTranscriber:
             # 對於臨時文件，記錄但不刪除，讓調用者決定如何處理
             return None
 
-    def _call_gemini_api_with_retry(self, client, model_name: str, contents: list, config) -> Optional[str]:
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        """
+        獲取限制同時處理區塊數量的信號量
+
+        信號量綁定創建時的事件循環，首次使用或事件循環變更時重新創建。
+
+        Returns:
+            當前事件循環的信號量
+        """
+        loop = asyncio.get_running_loop()
+        if self._sem is None or self._sem_loop is not loop:
+            self._sem = asyncio.Semaphore(self.max_workers)
+            self._sem_loop = loop
+        return self._sem
+
+    def _get_rate_limiter(self) -> AsyncRateLimiter:
+        """
+        獲取 API 請求限速器
+
+        限速器內部的鎖綁定創建時的事件循環，首次使用或事件循環變更時重新創建。
+
+        Returns:
+            當前事件循環的限速器
+        """
+        loop = asyncio.get_running_loop()
+        if self._rate_limiter is None or self._rate_limiter_loop is not loop:
+            self._rate_limiter = AsyncRateLimiter(self.requests_per_minute, 60.0)
+            self._rate_limiter_loop = loop
+        return self._rate_limiter
+
+    async def _call_gemini_api_with_retry(self, model_name: str, contents: list, config) -> Optional[str]:
         """
         帶重試機制的 Gemini API 調用
 
         Args:
-            client: Gemini 客戶端
             model_name: 模型名稱
             contents: 請求內容
             config: 配置對象
@@ -374,15 +706,18 @@ class GeminiTranscriber:
             try:
                 logger.debug(f"API 調用嘗試 {attempt + 1}/{self.max_retries}")
 
-                # 調用 API (使用流式響應)
-                full_text = ""
-                for chunk in client.models.generate_content_stream(
-                    model=model_name,
-                    contents=contents,
-                    config=config,
-                ):
-                    if chunk.text:
-                        full_text += chunk.text
+                # 調用異步 API (使用流式響應)，等待期間不阻塞事件循環
+                text_parts: List[str] = []
+                async with self._get_rate_limiter():
+                    async for chunk in await self._client.aio.models.generate_content_stream(
+                        model=model_name,
+                        contents=contents,
+                        config=config,
+                    ):
+                        if chunk.text:
+                            text_parts.append(chunk.text)
+
+                full_text = ''.join(text_parts)
 
                 if full_text.strip():
                     return full_text.strip()
@@ -393,8 +728,8 @@ class GeminiTranscriber:
                 logger.warning(f"API 調用失敗 (嘗試 {attempt + 1}/{self.max_retries}): {e}")
 
                 if attempt < self.max_retries - 1:
-                    import time
-                    time.sleep(self.retry_delay * (attempt + 1))  # 指數退避
+                    # 指數退避加隨機抖動，避免多個區塊同時重試
+                    await asyncio.sleep(self.retry_delay * (2 ** attempt) + random.random())
                 else:
                     logger.error(f"API 調用最終失敗，已重試 {self.max_retries} 次")
 
@@ -410,49 +745,140 @@ class GeminiTranscriber:
         Returns:
             MIME 類型字符串
         """
-        mime_types = {
-            '.mp3': 'audio/mpeg',
-            '.wav': 'audio/wav',
-            '.m4a': 'audio/mp4',
-            '.flac': 'audio/flac',
-            '.aac': 'audio/aac',
-            '.ogg': 'audio/ogg',
-            '.webm': 'audio/webm',
-            '.m4v': 'audio/mp4'
-        }
+        return _MIME_TYPES.get(audio_path.suffix.lower(), 'audio/mpeg')
 
-        return mime_types.get(audio_path.suffix.lower(), 'audio/mpeg')
+    def get_partial_result_path(self, audio_path: Path, segment_index: int) -> Path:
+        """
+        獲取區塊轉錄中間結果的保存路徑
 
-    async def transcribe_audio_parallel(self, segments: List[Tuple[Path, float, float]]) -> List[Dict]:
+        Args:
+            audio_path: 原始音頻文件路徑
+            segment_index: 區塊序號（從 1 開始）
+
+        Returns:
+            對應的 .partial.json 文件路徑
+        """
+        return audio_path.with_name(f"{audio_path.stem}.{segment_index:03d}.partial.json")
+
+    def load_partial_result(self, partial_path: Path, segment: Tuple[Path, float, float]) -> Optional[Dict]:
+        """
+        讀取上次運行中已完成的區塊轉錄結果
+
+        Args:
+            partial_path: 中間結果文件路徑
+            segment: (文件路徑, 開始時間, 結束時間)
+
+        Returns:
+            轉錄結果字典，如果不存在或與當前區塊不匹配則返回 None
+        """
+        try:
+            with open(partial_path, 'r', encoding='utf-8') as f:
+                result = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取中間結果失敗 {partial_path}: {e}")
+            return None
+
+        # 區塊邊界不一致時（例如分割參數已更改），不使用舊結果
+        _, start_time, end_time = segment
+        if (abs(result.get('start_time', -1) - start_time) > 0.5 or
+                abs(result.get('end_time', -1) - end_time) > 0.5):
+            return None
+
+        return result
+
+    def save_partial_result(self, partial_path: Path, result: Dict) -> None:
+        """
+        保存單個區塊的轉錄結果，供中斷後恢復使用
+
+        Args:
+            partial_path: 中間結果文件路徑
+            result: 區塊轉錄結果
+        """
+        try:
+            with open(partial_path, 'w', encoding='utf-8') as f:
+                json.dump(result, f, ensure_ascii=False)
+        except OSError as e:
+            logger.warning(f"保存中間結果失敗 {partial_path}: {e}")
+
+    def cleanup_partial_results(self, audio_path: Path, segment_count: int) -> None:
+        """
+        刪除音頻文件的所有區塊中間結果
+
+        Args:
+            audio_path: 原始音頻文件路徑
+            segment_count: 區塊數量
+        """
+        for segment_index in range(1, segment_count + 1):
+            partial_path = self.get_partial_result_path(audio_path, segment_index)
+            try:
+                partial_path.unlink(missing_ok=True)
+            except OSError as e:
+                logger.warning(f"清理中間結果失敗 {partial_path}: {e}")
+
+    async def transcribe_audio_parallel(
+        self, audio_path: Path, segments: AsyncIterator[Tuple[Path, float, float]]
+    ) -> Tuple[List[Tuple[Path, float, float]], List[Dict]]:
         """
         並行轉錄所有音頻區塊
 
+        每收到一個分割完成的區塊就立即開始轉錄，讓上傳與後續區塊的分割同時進行；
+        已在上次運行中完成的區塊會直接使用保存的中間結果，不再重新調用 API
+
         Args:
-            segments: 音頻區塊列表
+            audio_path: 原始音頻文件路徑
+            segments: 按順序產出音頻區塊的異步迭代器
 
         Returns:
-            轉錄結果列表
+            (已分割的區塊列表, 轉錄結果列表)
         """
-        logger.info(f"開始並行轉錄 {len(segments)} 個區塊")
+        logger.info(f"開始並行轉錄: {audio_path}")
+
+        async def transcribe_bounded(segment_index: int, segment: Tuple[Path, float, float]) -> Optional[Dict]:
+            partial_path = self.get_partial_result_path(audio_path, segment_index)
+            cached = self.load_partial_result(partial_path, segment)
+            if cached:
+                logger.info(f"使用已保存的區塊結果: {partial_path}")
+                return cached
+
+            # 限制同時進行的區塊數量，避免觸發 API 速率限制
+            async with self._get_semaphore():
+                result = await self.transcribe_segment_async(segment)
 
-        # 創建任務列表
+            if result:
+                self.save_partial_result(partial_path, result)
+            return result
+
+        # 每個區塊分割完成後立即創建轉錄任務
+        received = []
         tasks = []
-        for segment in segments:
-            task = self.transcribe_segment_async(segment)
-            tasks.append(task)
+        try:
+            async for segment in segments:
+                received.append(segment)
+                tasks.append(asyncio.create_task(transcribe_bounded(len(received), segment)))
+        except BaseException:
+            # 分割失敗時取消已開始的轉錄任務（已完成的區塊結果已保存）
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+
+        # 等待所有任務完成
+        outcomes = await asyncio.gather(*tasks, return_exceptions=True)
 
-        # 並行執行任務
         results = []
-        for coro in asyncio.as_completed(tasks):
-            result = await coro
-            if result:
-                results.append(result)
+        for segment, outcome in zip(received, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"轉錄區塊時發生錯誤 {segment[0]}: {outcome}")
+            elif outcome:
+                results.append(outcome)
 
         # 按時間順序排序
         results.sort(key=lambda x: x['start_time'])
 
-        logger.info(f"並行轉錄完成，共處理 {len(results)} 個區塊")
-        return results
+        logger.info(f"並行轉錄完成，共處理 {len(results)}/{len(received)} 個區塊")
+        return received, results
 
     def merge_transcription_results(self, results: List[Dict]) -> Dict:
         """
@@ -467,8 +893,8 @@ class GeminiTranscriber:
         if not results:
             return {'text': '', 'segments': []}
 
-        # 合併完整文本
-        full_text = ""
+        # 合併完整文本（收集片段後一次性拼接）
+        text_parts: List[str] = []
         merged_segments = []
 
         for i, result in enumerate(results):
@@ -478,8 +904,8 @@ class GeminiTranscriber:
                 if len(results) > 1:
                     start_time = result['start_time']
                     end_time = result['end_time']
-                    full_text += f"\n\n--- 區塊 {i+1} ({start_time:.0f}s - {end_time:.0f}s) ---\n"
-                full_text += segment_text
+                    text_parts.append(f"\n\n--- 區塊 {i+1} ({start_time:.0f}s - {end_time:.0f}s) ---\n")
+                text_parts.append(segment_text)
 
                 # 添加分段信息
                 merged_segments.append({
@@ -489,7 +915,7 @@ class GeminiTranscriber:
                 })
 
         return {
-            'text': full_text.strip(),
+            'text': ''.join(text_parts).strip(),
             'segments': merged_segments,
             'total_segments': len(results),
             'processing_time': time.time()
@@ -509,20 +935,22 @@ class GeminiTranscriber:
         try:
             transcript_path = self.get_transcript_path(audio_path)
 
-            # 準備保存的內容
-            transcript_content = f"音頻文件: {audio_path.name}\n"
-            transcript_content += f"轉錄時間: {time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-            transcript_content += f"使用模型: {self.model_name}\n"
-            transcript_content += f"處理區塊數: {result.get('total_segments', 1)}\n\n"
+            # 準備保存的內容（收集各行後一次性拼接）
+            lines = [
+                f"音頻文件: {audio_path.name}\n",
+                f"轉錄時間: {time.strftime('%Y-%m-%d %H:%M:%S')}\n",
+                f"使用模型: {self.model_name}\n",
+                f"處理區塊數: {result.get('total_segments', 1)}\n\n"
+            ]
 
             # 添加完整文本
             text = result.get('text', '').strip()
-            transcript_content += f"完整文本:\n{text}\n\n"
+            lines.append(f"完整文本:\n{text}\n\n")
 
             # 添加分段信息（如果有）
             segments = result.get('segments', [])
             if segments and len(segments) > 1:
-                transcript_content += "詳細分段:\n"
+                lines.append("詳細分段:\n")
                 for i, segment in enumerate(segments, 1):
                     start_time = segment.get('start', 0)
                     end_time = segment.get('end', 0)
@@ -532,11 +960,11 @@ class GeminiTranscriber:
                     start_str = f"{int(start_time)//60:02d}:{int(start_time)%60:02d}"
                     end_str = f"{int(end_time)//60:02d}:{int(end_time)%60:02d}"
 
-                    transcript_content += f"[區塊 {i}] {start_str} - {end_str}\n{segment_text}\n\n"
+                    lines.append(f"[區塊 {i}] {start_str} - {end_str}\n{segment_text}\n\n")
 
-            # 寫入文件
+            # 單次寫入文件
             with open(transcript_path, 'w', encoding='utf-8') as f:
-                f.write(transcript_content)
+                f.write(''.join(lines))
 
             logger.info(f"轉錄結果已保存: {transcript_path}")
             return True
@@ -545,22 +973,26 @@ class GeminiTranscriber:
             logger.error(f"保存轉錄結果失敗 {audio_path}: {e}")
             return False
 
-    def cleanup_segments(self, segments: List[Tuple[Path, float, float]], original_path: Path):
+    def _get_segment_temp_root(self, audio_path: Path) -> Optional[str]:
         """
-        清理臨時分割文件
+        選擇存放臨時分割文件的位置
+
+        優先使用內存文件系統 /dev/shm，避免在音頻所在的（可能較慢的）磁盤上重複讀寫
 
         Args:
-            segments: 音頻區塊列表
-            original_path: 原始音頻文件路徑
+            audio_path: 音頻文件路徑
+
+        Returns:
+            臨時目錄的父目錄，None 表示使用系統默認臨時目錄
         """
-        for segment_path, _, _ in segments:
-            try:
-                # 只刪除分割後的臨時文件，不刪除原始文件
-                if segment_path != original_path and segment_path.exists():
-                    segment_path.unlink()
-                    logger.info(f"清理臨時文件: {segment_path}")
-            except Exception as e:
-                logger.warning(f"清理臨時文件失敗 {segment_path}: {e}")
+        shm_dir = Path('/dev/shm')
+        try:
+            # 分割後的區塊總大小約等於原始文件，空間不足時改用默認臨時目錄
+            if shm_dir.is_dir() and shutil.disk_usage(shm_dir).free > audio_path.stat().st_size * 2:
+                return str(shm_dir)
+        except OSError:
+            pass
+        return None
 
     def get_status_info(self) -> Dict:
         """
@@ -570,17 +1002,12 @@ class GeminiTranscriber:
             狀態信息字典
         """
         audio_files = self.find_audio_files()
-        transcript_files = []
-
-        for audio_path in audio_files:
-            transcript_path = self.get_transcript_path(audio_path)
-            if transcript_path.exists():
-                transcript_files.append(transcript_path)
+        pending_count = sum(1 for _, needs in audio_files if needs)
 
         return {
             'total_audio_files': len(audio_files),
-            'transcribed_files': len(transcript_files),
-            'pending_files': len(audio_files) - len(transcript_files),
+            'transcribed_files': len(audio_files) - pending_count,
+            'pending_files': pending_count,
             'audio_dir': str(self.audio_dir),
             'supported_formats': list(self.audio_extensions),
             'model': self.model_name,
@@ -627,8 +1054,12 @@ class GeminiTranscriber:
 
             # 檢查 ffmpeg
             try:
-                import subprocess
-                result = subprocess.run(['ffmpeg', '-version'], capture_output=True)
+                result = subprocess.run(
+                    ['ffmpeg', '-version'],
+                    stdin=subprocess.DEVNULL,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL
+                )
                 if result.returncode == 0:
                     print("✓ FFmpeg 檢查通過")
                 else:
@@ -648,6 +1079,8 @@ class GeminiTranscriber:
         """
         異步處理單個音頻文件
 
+        調用者只應傳入仍需轉錄的文件；已有的轉錄文件會被覆蓋
+
         Args:
             audio_path: 音頻文件路徑
 
@@ -657,20 +1090,18 @@ class GeminiTranscriber:
         try:
             logger.info(f"開始處理音頻文件: {audio_path}")
 
-            # 檢查是否需要轉錄
-            if not self.needs_transcription(audio_path):
-                logger.info(f"跳過已轉錄的文件: {audio_path}")
-                return True
+            # 分割文件寫入臨時目錄，離開上下文（包括異常中斷）時自動刪除
+            with tempfile.TemporaryDirectory(prefix='gemini_segments_',
+                                             dir=self._get_segment_temp_root(audio_path)) as temp_dir:
+                # 分割音頻文件，並行轉錄每個分割完成的區塊
+                segments, results = await self.transcribe_audio_parallel(
+                    audio_path, self.split_audio_file(audio_path, Path(temp_dir))
+                )
 
-            # 分割音頻文件
-            segments = self.split_audio_file(audio_path)
             if not segments:
                 logger.error(f"音頻分割失敗: {audio_path}")
                 return False
 
-            # 並行轉錄所有區塊
-            results = await self.transcribe_audio_parallel(segments)
-
             if not results:
                 logger.error(f"所有區塊轉錄失敗: {audio_path}")
                 return False
@@ -682,8 +1113,8 @@ class GeminiTranscriber:
             if self.save_transcript(audio_path, merged_result):
                 logger.info(f"成功處理音頻文件: {audio_path}")
 
-                # 清理臨時文件
-                self.cleanup_segments(segments, audio_path)
+                # 清理區塊中間結果
+                self.cleanup_partial_results(audio_path, len(segments))
 
                 return True
             else:
@@ -706,25 +1137,25 @@ class GeminiTranscriber:
             logger.warning("沒有找到音頻文件")
             return
 
+        # 掃描時已確定轉錄狀態，只處理待轉錄的文件
+        pending_files = [audio_path for audio_path, needs in audio_files if needs]
+
         # 統計信息
         processed_count = 0
-        skipped_count = 0
+        skipped_count = len(audio_files) - len(pending_files)
         failed_count = 0
 
+        if skipped_count:
+            logger.info(f"跳過 {skipped_count} 個已轉錄的文件")
+
         # 處理每個音頻文件
         async def process_all():
-            nonlocal processed_count, skipped_count, failed_count
+            nonlocal processed_count, failed_count
 
-            for audio_path in audio_files:
+            for audio_path in pending_files:
                 try:
                     logger.info(f"處理文件: {audio_path}")
 
-                    # 檢查是否需要轉錄
-                    if not self.needs_transcription(audio_path):
-                        logger.info(f"跳過已轉錄的文件: {audio_path}")
-                        skipped_count += 1
-                        continue
-
                     # 異步處理文件
                     if await self.process_audio_file_async(audio_path):
                         processed_count += 1
@@ -751,10 +1182,9 @@ def main():
     print("=" * 50)
 
     # 檢查依賴
-    try:
-        from google import genai
+    if genai is not None:
         print("✓ google-genai 模塊檢查通過")
-    except ImportError:
+    else:
         print("❌ 錯誤：缺少必要的依賴 google-genai")
         print("請執行以下命令安裝:")
         print("  pip install google-genai")
@@ -774,7 +1204,7 @@ def main():
     # 創建轉錄器實例
     try:
         transcriber = GeminiTranscriber()
-    except ValueError as e:
+    except (ValueError, ImportError) as e:
         print(f"❌ 初始化失敗: {e}")
         return
 
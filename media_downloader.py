@@ -16,25 +16,49 @@
 
 import os
 import re
+import atexit
 import json
-import subprocess
+import asyncio
+import queue
 import shutil
+import sqlite3
+import tempfile
+import threading
+import hashlib
 from pathlib import Path
-from urllib.parse import urlparse
-from typing import Optional, Dict, List
+from urllib.parse import urlparse, parse_qs
+from typing import Optional, Dict, List, Set, Tuple
 import logging
-
-# 配置日誌
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('downloader.log', encoding='utf-8'),
-        logging.StreamHandler()
-    ]
-)
+import logging.handlers
+
+# 配置日誌：記錄先放入隊列，由後台線程寫入文件和終端，避免事件循環被 I/O 阻塞
+_log_formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(message)s')
+_log_handlers = [
+    logging.FileHandler('downloader.log', encoding='utf-8'),
+    logging.StreamHandler()
+]
+for _handler in _log_handlers:
+    _handler.setFormatter(_log_formatter)
+
+_log_queue = queue.Queue(-1)
+_log_listener = logging.handlers.QueueListener(_log_queue, *_log_handlers)
+# 導入即啟動監聽線程；退出時由 atexit 停止，確保隊列中的記錄全部寫出
+_log_listener.start()
+atexit.register(_log_listener.stop)
+
+# 根日誌器只負責把記錄放入隊列，格式化在監聽線程的處理器中進行
+_root_logger = logging.getLogger()
+_root_logger.setLevel(logging.INFO)
+_root_logger.addHandler(logging.handlers.QueueHandler(_log_queue))
 logger = logging.getLogger(__name__)
 
+# 文件名清理：移除文件系統不允許的字符，並合併連續空白
+_INVALID_FS_CHARS = str.maketrans('', '', '<>:"/\\|?*')
+_WS = re.compile(r'\s+')
+
+# MP4 系列容器的 moov 索引可能位於文件末尾，ffmpeg 需要可定位的輸入，不能從管道讀取
+_MP4_FAMILY_EXTS = frozenset({'mp4', 'm4a', 'm4b', 'm4v', 'mov', '3gp'})
+
 class MediaDownloader:
     """媒體下載器主類"""
 
@@ -82,6 +106,12 @@ class MediaDownloader:
             ]
         }
 
+        # 預編譯每種媒體類型的URL模式（合併為單個正則），檢測時按順序匹配
+        self._detectors = [
+            (media_type, re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE))
+            for media_type, patterns in self.media_patterns.items()
+        ]
+
         # 音頻轉碼設定
         self.audio_format = {
             'format': 'mp3',
@@ -91,6 +121,36 @@ class MediaDownloader:
             'bitrate': 128000  # 128kbps，對於語音內容來說足夠
         }
 
+        # ffmpeg 編碼參數（與 audio_format 對應）
+        self.ffmpeg_encode_args = [
+            '-c:a', 'libmp3lame',  # MP3 編碼器
+            '-b:a', '128k',  # 128kbps 比特率
+            '-ar', '16000',  # 16 kHz
+            '-ac', '1'  # 單聲道
+        ]
+
+        # 外部命令的絕對路徑（只查找一次，避免每次啟動子進程都遍歷 PATH）
+        self._ytdlp = shutil.which('yt-dlp') or 'yt-dlp'
+        self._ffmpeg = shutil.which('ffmpeg') or 'ffmpeg'
+
+        # 並行設定
+        self.max_concurrent_downloads = 8  # 同時進行的下載數量
+        self.max_concurrent_transcodes = os.cpu_count() or 1  # 同時進行的轉碼數量
+
+        # 已處理URL的持久化記錄，避免每次運行都為去重檢查訪問網絡和掃描目錄
+        self._db = self._open_processed_db()
+        # 數據庫操作在線程中執行（提交時需要寫盤），同一時間只允許一個線程使用連接
+        self._db_lock = threading.Lock()
+        # 編碼參數的指紋，參數變更後已處理的文件會重新轉碼
+        self._params_hash = hashlib.sha1(json.dumps(self.ffmpeg_encode_args).encode('utf-8')).hexdigest()
+
+        # 各輸出目錄中已處理文件名（不含擴展名）的索引，每個目錄只掃描一次
+        self._dir_index: Dict[Path, Set[str]] = {}
+        # 正在下載的輸出文件，避免並行處理的不同鏈接寫入同一個文件
+        self._in_flight: Set[Path] = set()
+        # 下載目錄中有沒有處理記錄的舊文件時，下載前先獲取元數據檢查，避免重複下載
+        self._probe_before_download = True
+
     def detect_media_type(self, url: str) -> str:
         """
         檢測URL的媒體類型
@@ -101,21 +161,198 @@ class MediaDownloader:
         Returns:
             媒體類型字符串
         """
-        for media_type, patterns in self.media_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, url, re.IGNORECASE):
-                    return media_type
+        for media_type, detector in self._detectors:
+            if detector.search(url):
+                return media_type
 
         # 如果無法識別，返回通用類型
         return 'generic'
 
-    def get_channel_name(self, url: str, media_type: str) -> str:
+    def _open_processed_db(self) -> sqlite3.Connection:
+        """
+        打開（或創建）已處理URL記錄數據庫
+
+        Returns:
+            SQLite 連接
+        """
+        db = sqlite3.connect(self.download_dir / '.processed.sqlite', check_same_thread=False)
+        # params_hash 為生成該文件時的 ffmpeg 編碼參數指紋
+        db.execute(
+            'CREATE TABLE IF NOT EXISTS processed ('
+            'url TEXT PRIMARY KEY, output_path TEXT, mtime REAL, params_hash TEXT)'
+        )
+        db.commit()
+        return db
+
+    def _lookup_processed(self, url: str) -> Optional[Tuple[Path, str]]:
+        """
+        查詢URL的處理記錄
+
+        Args:
+            url: 媒體URL
+
+        Returns:
+            (輸出文件路徑, 編碼參數指紋)，如果沒有記錄或文件已不存在則返回None
+        """
+        with self._db_lock:
+            row = self._db.execute(
+                'SELECT output_path, params_hash FROM processed WHERE url = ?',
+                (url,)
+            ).fetchone()
+
+        if row and os.path.exists(row[0]):
+            return Path(row[0]), row[1]
+        return None
+
+    def _mark_processed(self, url: str, output_path: Path) -> None:
+        """
+        記錄URL已處理完成（使用當前編碼參數）
+
+        Args:
+            url: 媒體URL
+            output_path: 輸出文件路徑
+        """
+        try:
+            mtime = output_path.stat().st_mtime
+            with self._db_lock:
+                self._db.execute(
+                    'INSERT OR REPLACE INTO processed (url, output_path, mtime, params_hash) VALUES (?, ?, ?, ?)',
+                    (url, str(output_path), mtime, self._params_hash)
+                )
+                self._db.commit()
+        except Exception as e:
+            logger.warning(f"寫入處理記錄失敗 {url}: {e}")
+
+    def normalize_url(self, url: str) -> str:
+        """
+        規範化URL，使指向同一媒體的不同寫法合併為同一個鏈接
+
+        YouTube 短鏈接和帶時間、播放列表參數的鏈接統一為 https://www.youtube.com/watch?v=ID
+        （下載時使用 --no-playlist，播放列表參數不影響結果）
+
+        Args:
+            url: 媒體URL
+
+        Returns:
+            規範化後的URL，無法識別時返回原URL
+        """
+        try:
+            parsed = urlparse(url if '://' in url else f'https://{url}')
+            host = parsed.netloc.lower()
+            for prefix in ('www.', 'm.'):
+                if host.startswith(prefix):
+                    host = host[len(prefix):]
+
+            video_id = None
+            if host == 'youtu.be':
+                video_id = parsed.path.strip('/').split('/')[0]
+            elif host in ('youtube.com', 'music.youtube.com') and parsed.path == '/watch':
+                video_id = parse_qs(parsed.query).get('v', [None])[0]
+
+            if video_id:
+                return f"https://www.youtube.com/watch?v={video_id}"
+
+        except Exception as e:
+            logger.warning(f"規範化URL失敗 {url}: {e}")
+
+        return url
+
+    async def _run_command(self, cmd: List[str], cwd: Optional[Path] = None,
+                           timeout: Optional[float] = None) -> Tuple[int, str, str]:
+        """
+        異步執行外部命令
+
+        Args:
+            cmd: 命令及參數列表
+            cwd: 工作目錄
+            timeout: 超時時間（秒），None 表示不限制
+
+        Returns:
+            (返回碼, 標準輸出, 標準錯誤)，標準錯誤只在命令失敗時解碼，成功時為空字串
+
+        Raises:
+            asyncio.TimeoutError: 命令執行超時
+        """
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            cwd=str(cwd) if cwd else None,
+            stdin=asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        try:
+            stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            raise
+
+        return (
+            process.returncode,
+            stdout.decode('utf-8', 'replace'),
+            stderr.decode('utf-8', 'replace') if process.returncode != 0 else ''
+        )
+
+    async def _get_metadata(self, url: str) -> Optional[dict]:
+        """
+        下載前獲取媒體元數據（只輸出用到的字段）
+
+        Args:
+            url: 媒體URL
+
+        Returns:
+            包含 title、uploader、channel、ext 的字典，如果失敗則返回None
+        """
+        try:
+            cmd = [
+                self._ytdlp,
+                '--format', 'bestaudio/best',  # 與下載時的設定一致，ext 為將要下載的格式
+                '--print', '%(.{title,uploader,channel,ext})j',
+                '--skip-download',
+                '--no-playlist',  # 與下載時的設定一致
+                '--no-warnings',
+                '--quiet',
+                url
+            ]
+
+            returncode, stdout, stderr = await self._run_command(cmd, timeout=30)
+
+            if returncode == 0:
+                return json.loads(stdout.strip())
+
+            logger.warning(f"獲取元數據失敗 {url}: {stderr.strip()}")
+
+        except Exception as e:
+            logger.warning(f"獲取元數據失敗 {url}: {e!r}")
+
+        return None
+
+    def _load_info_json(self, info_path: Path) -> Optional[dict]:
+        """
+        讀取 yt-dlp 下載時寫出的元數據文件
+
+        Args:
+            info_path: 元數據文件路徑
+
+        Returns:
+            元數據字典，如果失敗則返回None
+        """
+        try:
+            with open(info_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.warning(f"讀取元數據文件失敗 {info_path}: {e}")
+            return None
+
+    def get_channel_name(self, url: str, media_type: str, metadata: Optional[dict]) -> str:
         """
-        從URL中提取頻道/節目名稱
+        從URL或元數據中提取頻道/節目名稱
 
         Args:
             url: 媒體URL
             media_type: 媒體類型
+            metadata: yt-dlp 寫出的元數據，沒有時為None
 
         Returns:
             頻道/節目名稱
@@ -149,25 +386,8 @@ class MediaDownloader:
                                 clean_name = re.sub(r'-.*$', '', podcast_slug).replace('-', ' ').strip()
                                 return f"{clean_name}_apple_podcast"
 
-            # 對於其他媒體類型，使用 yt-dlp 獲取元數據
-            cmd = [
-                'yt-dlp',
-                '--dump-json',
-                '--no-download',
-                '--quiet',
-                url
-            ]
-
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=30
-            )
-
-            if result.returncode == 0:
-                metadata = json.loads(result.stdout.strip())
+            # 對於其他媒體類型，使用 yt-dlp 的元數據
+            if metadata:
                 uploader = metadata.get('uploader', '')
                 channel = metadata.get('channel', '')
                 title = metadata.get('title', '')
@@ -180,8 +400,7 @@ class MediaDownloader:
                     name = channel or uploader or title
 
                 # 清理名稱中的無效字符
-                name = re.sub(r'[<>:"/\\|?*]', '', name)
-                name = re.sub(r'\s+', ' ', name).strip()
+                name = _WS.sub(' ', name.translate(_INVALID_FS_CHARS)).strip()
 
                 if name:
                     # 為不同媒體類型添加後綴
@@ -198,12 +417,25 @@ class MediaDownloader:
             # 如果yt-dlp失敗，使用通用備用方案
             parsed = urlparse(url)
             domain = parsed.netloc.replace('www.', '')
-            return f"{domain}_{hash(url) % 10000}"
+            return f"{domain}_{self._url_digest(url)}"
 
         except Exception as e:
             logger.warning(f"獲取頻道名稱失敗: {e}")
             # 使用URL的hash作為備用名稱
-            return f"unknown_channel_{hash(url) % 10000}"
+            return f"unknown_channel_{self._url_digest(url)}"
+
+    @staticmethod
+    def _url_digest(url: str) -> str:
+        """
+        計算URL的短哈希，用作備用名稱後綴（跨進程穩定，不受 PYTHONHASHSEED 影響）
+
+        Args:
+            url: 媒體URL
+
+        Returns:
+            8 位十六進位字串
+        """
+        return hashlib.blake2b(url.encode('utf-8'), digest_size=4).hexdigest()
 
     def create_download_directory(self, channel_name: str) -> Path:
         """
@@ -219,189 +451,468 @@ class MediaDownloader:
         channel_dir.mkdir(exist_ok=True)
         return channel_dir
 
-    def get_expected_output_path(self, url: str, output_dir: Path) -> Optional[Path]:
+    def get_output_path(self, url: str, output_dir: Path, metadata: Optional[dict]) -> Path:
         """
-        獲取預期的輸出文件路徑（用於去重檢查）
+        獲取輸出文件路徑：{title}_processed.mp3
 
         Args:
             url: 媒體URL
             output_dir: 輸出目錄
+            metadata: yt-dlp 寫出的元數據，沒有時為None
 
         Returns:
-            預期的輸出文件路徑，如果無法獲取則返回None
+            輸出文件路徑
         """
-        try:
-            # 使用 yt-dlp 獲取元數據來預測文件名
-            cmd = [
-                'yt-dlp',
-                '--dump-json',
-                '--no-download',
-                '--quiet',
-                url
-            ]
+        title = (metadata or {}).get('title') or ''
 
-            result = subprocess.run(
-                cmd,
-                capture_output=True,
-                text=True,
-                encoding='utf-8',
-                timeout=30
-            )
+        # 清理文件名中的無效字符
+        clean_title = _WS.sub(' ', title.translate(_INVALID_FS_CHARS)).strip()
 
-            if result.returncode == 0:
-                metadata = json.loads(result.stdout.strip())
-                title = metadata.get('title', '')
+        if not clean_title:
+            domain = urlparse(url).netloc.replace('www.', '')
+            clean_title = f"{domain}_{self._url_digest(url)}"
 
-                if title:
-                    # 清理文件名中的無效字符
-                    clean_title = re.sub(r'[<>:"/\\|?*]', '', title)
-                    clean_title = re.sub(r'\s+', ' ', clean_title).strip()
+        return output_dir / f"{clean_title}_processed.mp3"
 
-                    # 預測最終的輸出文件名：{title}_processed.mp3
-                    expected_filename = f"{clean_title}_processed.mp3"
-                    return output_dir / expected_filename
+    @staticmethod
+    def _scan_processed_stems(output_dir: Path) -> Set[str]:
+        """
+        掃描目錄中所有以 _processed.mp3 結尾的文件
 
-        except Exception as e:
-            logger.warning(f"獲取預期輸出路徑失敗 {url}: {e}")
+        Args:
+            output_dir: 輸出目錄
 
-        return None
+        Returns:
+            文件名（不含擴展名）集合
+        """
+        stems = set()
+        try:
+            with os.scandir(output_dir) as it:
+                for entry in it:
+                    if entry.name.endswith('_processed.mp3') and entry.is_file():
+                        stems.add(entry.name[:-len('.mp3')])
+        except FileNotFoundError:
+            pass
+        return stems
+
+    def _scan_download_dir(self) -> int:
+        """
+        遍歷下載目錄一次，建立各目錄的已處理文件索引，並統計沒有處理記錄的舊文件
 
-    def is_already_processed(self, url: str, output_dir: Path) -> bool:
+        Returns:
+            沒有處理記錄的 _processed.mp3 文件數量
+        """
+        with self._db_lock:
+            recorded_paths = {
+                os.path.abspath(row[0])
+                for row in self._db.execute('SELECT output_path FROM processed')
+            }
+
+        unrecorded = 0
+        for dirpath, dirnames, filenames in os.walk(self.download_dir):
+            dirnames[:] = [d for d in dirnames if not d.startswith('.')]  # 跳過隱藏目錄
+            stems = set()
+            for name in filenames:
+                if name.endswith('_processed.mp3'):
+                    stems.add(name[:-len('.mp3')])
+                    if os.path.abspath(os.path.join(dirpath, name)) not in recorded_paths:
+                        unrecorded += 1
+            self._dir_index.setdefault(Path(dirpath), stems)
+        return unrecorded
+
+    async def _get_dir_index(self, output_dir: Path) -> Set[str]:
         """
-        檢查URL是否已經被處理過
+        獲取目錄的已處理文件索引，首次訪問時在線程中掃描目錄
 
         Args:
-            url: 媒體URL
             output_dir: 輸出目錄
 
         Returns:
-            如果已經處理過則返回True
+            文件名（不含擴展名）集合
+        """
+        if output_dir not in self._dir_index:
+            stems = await asyncio.to_thread(self._scan_processed_stems, output_dir)
+            self._dir_index.setdefault(output_dir, stems)
+        return self._dir_index[output_dir]
+
+    async def is_already_processed(self, url: str, output_path: Path) -> bool:
+        """
+        檢查頻道目錄中是否已有該URL的輸出文件（沒有處理記錄的舊文件）
+
+        使用目錄索引查找，每個頻道目錄只掃描一次。精確匹配時寫入處理記錄；
+        寬鬆匹配（文件名包含標題）可能對應其他媒體（例如 "Episode 1" 與 "Episode 10"），
+        只跳過本次處理，不記錄到數據庫。
+
+        Args:
+            url: 媒體URL
+            output_path: 預期的輸出文件路徑
+
+        Returns:
+            如果已存在則返回True
+        """
+        existing_path = await self._find_processed_file(output_path)
+        if existing_path is None:
+            return False
+
+        if existing_path == output_path:
+            logger.info(f"檢測到已處理的文件，跳過: {existing_path}")
+            await asyncio.to_thread(self._mark_processed, url, existing_path)
+        else:
+            logger.info(f"檢測到已處理的文件（寬鬆匹配，不記錄），跳過: {existing_path}")
+        return True
+
+    async def _find_processed_file(self, output_path: Path) -> Optional[Path]:
+        """
+        在輸出目錄中查找已存在的處理結果（沒有處理記錄的舊文件）
+
+        Args:
+            output_path: 預期的輸出文件路徑
+
+        Returns:
+            已存在的文件路徑，如果沒有則返回None
         """
         try:
+            index = await self._get_dir_index(output_path.parent)
+
             # 首先嘗試精確匹配
-            expected_path = self.get_expected_output_path(url, output_dir)
-            if expected_path and expected_path.exists():
-                logger.info(f"檢測到已處理的文件，跳過: {expected_path}")
-                return True
+            if output_path.stem in index:
+                return output_path
 
             # 如果精確匹配失敗，嘗試寬鬆匹配：查找任何包含原始標題且以 _processed.mp3 結尾的文件
-            if expected_path:
-                base_title = expected_path.stem.replace('_processed', '')
-                # 查找匹配的文件
-                for file_path in output_dir.glob('*_processed.mp3'):
-                    if base_title in file_path.stem:
-                        logger.info(f"檢測到已處理的文件（寬鬆匹配），跳過: {file_path}")
-                        return True
+            base_title = output_path.stem.replace('_processed', '')
+            for stem in index:
+                if base_title in stem:
+                    return output_path.with_name(f"{stem}.mp3")
 
         except Exception as e:
-            logger.warning(f"檢查處理狀態時發生錯誤 {url}: {e}")
+            logger.warning(f"查找已處理文件時發生錯誤 {output_path}: {e}")
+
+        return None
 
-        return False
+    def _claim_output_path(self, output_path: Path) -> bool:
+        """
+        標記輸出文件正在處理
+
+        檢查和標記之間沒有 await，並行的任務不會同時取得同一個輸出文件。
+
+        Args:
+            output_path: 輸出文件路徑
+
+        Returns:
+            如果成功標記則返回True，已有其他鏈接正在處理該文件則返回False
+        """
+        if output_path in self._in_flight:
+            logger.info(f"其他鏈接正在處理相同的輸出文件，跳過: {output_path}")
+            return False
+        self._in_flight.add(output_path)
+        return True
 
-    def download_media(self, url: str, output_dir: Path) -> Optional[str]:
+    async def _resolve_output_path(self, url: str, media_type: str, metadata: Optional[dict]) -> Path:
         """
-        下載媒體文件
+        根據元數據確定頻道目錄（不存在時創建）和輸出文件路徑
 
         Args:
             url: 媒體URL
-            output_dir: 輸出目錄
+            media_type: 媒體類型
+            metadata: yt-dlp 的元數據，沒有時為None
+
+        Returns:
+            輸出文件路徑
+        """
+        channel_name = self.get_channel_name(url, media_type, metadata)
+        logger.info(f"頻道名稱: {channel_name}")
+
+        download_path = await asyncio.to_thread(self.create_download_directory, channel_name)
+        logger.info(f"下載目錄: {download_path}")
+
+        return self.get_output_path(url, download_path, metadata)
+
+    async def download_media(self, url: str, media_type: str,
+                             output_path: Optional[Path] = None,
+                             source_ext: Optional[str] = None) -> Optional[str]:
+        """
+        下載媒體並直接轉碼為最終音頻文件
+
+        yt-dlp 將原始音頻流輸出到管道，由單個 ffmpeg 進程讀取並編碼，
+        避免先由 yt-dlp 轉成 MP3 再重新編碼一次。MP4 系列容器（或格式未知）時
+        ffmpeg 需要可定位的輸入，改為先下載到臨時文件再轉碼。
+        未提供輸出路徑時（下載前沒有獲取元數據），yt-dlp 同時寫出元數據文件，
+        完成後據此確定頻道目錄和文件名。
+
+        Args:
+            url: 媒體URL
+            media_type: 媒體類型
+            output_path: 輸出文件路徑，None 表示下載後根據元數據確定
+            source_ext: 將要下載的格式的擴展名，None 表示未知
 
         Returns:
-            下載的文件路徑，如果失敗則返回None
+            處理後的文件路徑，如果失敗則返回None
         """
+        work_dir = None
+        claimed = None
         try:
-            # 確保輸出目錄存在
-            output_dir.mkdir(parents=True, exist_ok=True)
+            # 臨時工作目錄放在系統臨時目錄，不在轉錄器掃描的下載目錄內，
+            # 避免未完成（或中斷後殘留）的下載被當作音頻文件轉錄
+            work_dir = Path(await asyncio.to_thread(tempfile.mkdtemp, prefix='media_download_'))
+            part_path = work_dir / 'audio.mp3'
 
-            # 構建 yt-dlp 命令 - 使用相對路徑避免嵌套問題
-            cmd = [
-                'yt-dlp',
+            ytdlp_cmd = [
+                self._ytdlp,
                 '--format', 'bestaudio/best',  # 優先下載最高品質音頻
-                '--output', '%(title)s.%(ext)s',  # 使用相對路徑
                 '--no-playlist',  # 不下載播放列表中的所有項目
-                '--extract-audio',  # 提取音頻
-                '--audio-format', 'mp3',  # 輸出為MP3格式
-                '--audio-quality', '128K',  # 128kbps，平衡品質和檔案大小
                 '--quiet',  # 安靜模式
-                '--no-warnings',  # 不顯示警告
-                url
+                '--no-warnings'  # 不顯示警告
             ]
+            if output_path is None:
+                # 下載時同時寫出元數據，文件名：meta.info.json
+                ytdlp_cmd += ['--write-info-json', '--output', 'infojson:meta']
 
             logger.info(f"開始下載: {url}")
-            logger.info(f"輸出目錄: {output_dir}")
-            result = subprocess.run(
-                cmd,
-                cwd=str(output_dir),
-                capture_output=True,
-                text=True,
-                encoding='utf-8'
-            )
-
-            if result.returncode == 0:
-                # 查找下載的文件，優先查找MP3文件
-                downloaded_files = list(output_dir.glob('*.mp3'))
-                if downloaded_files:
-                    return str(downloaded_files[0])
-
-                # 如果沒有找到MP3文件，查找其他音頻文件
-                audio_files = list(output_dir.glob('*'))
-                audio_extensions = ['.wav', '.m4a', '.webm', '.flac', '.aac']
-                for file in audio_files:
-                    if file.suffix.lower() in audio_extensions:
-                        return str(file)
 
-            logger.error(f"下載失敗: {result.stderr}")
-            return None
+            if source_ext is not None and source_ext not in _MP4_FAMILY_EXTS:
+                downloaded = await self._download_piped(ytdlp_cmd + ['--output', '-', url], part_path, work_dir)
+            else:
+                downloaded = await self._download_to_file(ytdlp_cmd + ['--output', 'source.%(ext)s', url], part_path, work_dir)
+
+            if not downloaded:
+                return None
+
+            if output_path is None:
+                # 根據下載時寫出的元數據確定頻道目錄和文件名
+                metadata = await asyncio.to_thread(self._load_info_json, work_dir / 'meta.info.json')
+                output_path = await self._resolve_output_path(url, media_type, metadata)
+
+                # 沒有處理記錄的舊文件（例如舊版本下載的文件）已存在時保留原文件，
+                # 其他鏈接正在寫入同一個文件時同樣跳過
+                if await self.is_already_processed(url, output_path):
+                    return str(output_path)
+                if not self._claim_output_path(output_path):
+                    return str(output_path)
+                claimed = output_path
+
+            await asyncio.to_thread(self._move_into_place, part_path, output_path)
+            (await self._get_dir_index(output_path.parent)).add(output_path.stem)
+            await asyncio.to_thread(self._mark_processed, url, output_path)
+            logger.info(f"音頻轉換成功: {output_path}")
+            return str(output_path)
 
         except Exception as e:
             logger.error(f"下載過程中發生錯誤: {e}")
             return None
 
-    def convert_audio_format(self, input_file: str, output_file: str) -> bool:
+        finally:
+            if claimed is not None:
+                self._in_flight.discard(claimed)
+            if work_dir is not None:
+                await asyncio.to_thread(shutil.rmtree, work_dir, ignore_errors=True)
+
+    def _encode_cmd(self, input_spec: str, part_path: Path) -> List[str]:
         """
-        轉換音頻格式為 MP3 128kbps / 單聲道 / 16 kHz
+        構建 ffmpeg 轉碼命令
 
         Args:
-            input_file: 輸入文件路徑
-            output_file: 輸出文件路徑
+            input_spec: 輸入文件路徑或 pipe:0
+            part_path: 輸出文件路徑
 
         Returns:
-            轉換是否成功
+            ffmpeg 命令列表
         """
-        try:
-            cmd = [
-                'ffmpeg',
-                '-i', input_file,
-                '-acodec', 'libmp3lame',  # MP3 編碼器
-                '-b:a', '128k',  # 128kbps 比特率
-                '-ar', '16000',  # 16 kHz
-                '-ac', '1',  # 單聲道
-                '-y',  # 覆蓋輸出文件
-                '-loglevel', 'error',  # 只顯示錯誤
-                output_file
-            ]
+        return [
+            self._ffmpeg,
+            '-i', input_spec,
+            '-vn',  # 忽略視頻流
+            *self.ffmpeg_encode_args,
+            '-f', 'mp3',
+            '-y',  # 覆蓋輸出文件
+            '-loglevel', 'error',  # 只顯示錯誤
+            str(part_path)
+        ]
+
+    async def _download_piped(self, ytdlp_cmd: List[str], part_path: Path, work_dir: Path) -> bool:
+        """
+        yt-dlp 輸出到管道，由 ffmpeg 邊下載邊轉碼
 
-            result = subprocess.run(cmd, capture_output=True, text=True)
+        Args:
+            ytdlp_cmd: yt-dlp 命令（輸出到標準輸出）
+            part_path: 轉碼輸出文件路徑
+            work_dir: 工作目錄
 
-            if result.returncode == 0:
-                logger.info(f"音頻轉換成功: {output_file}")
-                return True
-            else:
-                logger.error(f"音頻轉換失敗: {result.stderr}")
+        Returns:
+            是否成功
+        """
+        ytdlp = ffmpeg = None
+        try:
+            read_fd, write_fd = os.pipe()
+            try:
+                ytdlp = await asyncio.create_subprocess_exec(
+                    *ytdlp_cmd,
+                    cwd=str(work_dir),
+                    stdin=asyncio.subprocess.DEVNULL,
+                    stdout=write_fd,
+                    stderr=asyncio.subprocess.PIPE
+                )
+                ffmpeg = await asyncio.create_subprocess_exec(
+                    *self._encode_cmd('pipe:0', part_path),
+                    stdin=read_fd,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.PIPE
+                )
+            finally:
+                # 管道兩端已交給子進程，父進程必須關閉，否則 ffmpeg 收不到 EOF
+                os.close(read_fd)
+                os.close(write_fd)
+
+            (_, ytdlp_err), (_, ffmpeg_err) = await asyncio.gather(
+                ytdlp.communicate(), ffmpeg.communicate()
+            )
+
+            if ytdlp.returncode != 0:
+                logger.error(f"下載失敗: {ytdlp_err.decode('utf-8', 'replace')}")
                 return False
+            if ffmpeg.returncode != 0:
+                logger.error(f"音頻轉換失敗: {ffmpeg_err.decode('utf-8', 'replace')}")
+                return False
+            return True
 
-        except Exception as e:
-            logger.error(f"音頻轉換過程中發生錯誤: {e}")
+        finally:
+            for process in (ytdlp, ffmpeg):
+                if process is not None and process.returncode is None:
+                    process.kill()
+                    await process.wait()
+
+    async def _download_to_file(self, ytdlp_cmd: List[str], part_path: Path, work_dir: Path) -> bool:
+        """
+        先下載到工作目錄中的臨時文件，再由 ffmpeg 轉碼（輸入可定位）
+
+        Args:
+            ytdlp_cmd: yt-dlp 命令（輸出為 source.<ext>）
+            part_path: 轉碼輸出文件路徑
+            work_dir: 工作目錄
+
+        Returns:
+            是否成功
+        """
+        returncode, _, stderr = await self._run_command(ytdlp_cmd, cwd=work_dir)
+        if returncode != 0:
+            logger.error(f"下載失敗: {stderr}")
             return False
 
-    def process_download_list(self) -> None:
-        """處理下載列表中的所有鏈接"""
+        sources = [p for p in work_dir.glob('source.*') if not p.name.endswith('.part')]
+        if not sources:
+            logger.error(f"下載失敗: 找不到下載的文件 {work_dir}")
+            return False
+
+        returncode, _, stderr = await self._run_command(self._encode_cmd(str(sources[0]), part_path))
+        if returncode != 0:
+            logger.error(f"音頻轉換失敗: {stderr}")
+            return False
+        return True
+
+    @staticmethod
+    def _move_into_place(src: Path, dst: Path) -> None:
+        """
+        將文件移動到目標位置
+
+        臨時目錄可能與下載目錄不在同一文件系統，跨文件系統時先複製為 .part 文件再改名，
+        確保目標位置不會出現不完整的音頻文件。
+
+        Args:
+            src: 源文件路徑
+            dst: 目標文件路徑
+        """
+        part_dst = dst.with_name(dst.name + '.part')
+        shutil.move(str(src), str(part_dst))
+        os.replace(part_dst, dst)
+
+    async def _process_one(self, url: str, sem_dl: asyncio.Semaphore, sem_ff: asyncio.Semaphore) -> None:
+        """
+        處理單個鏈接：檢查處理記錄和已有文件、下載並轉換格式
+
+        Args:
+            url: 媒體URL
+            sem_dl: 限制同時進行的下載數量的信號量
+            sem_ff: 限制同時進行的 ffmpeg 轉碼數量的信號量
+        """
+        output_path = None
+        claimed = False
+        try:
+            logger.info(f"處理鏈接: {url}")
+
+            # 檢測媒體類型
+            media_type = self.detect_media_type(url)
+            logger.info(f"檢測到媒體類型: {media_type}")
+
+            # 檢查處理記錄（去重機制，無需訪問網絡）
+            record = await asyncio.to_thread(self._lookup_processed, url)
+            metadata = None
+            if record:
+                recorded_path, params_hash = record
+                if params_hash == self._params_hash:
+                    logger.info(f"檢測到已處理的文件（處理記錄），跳過: {recorded_path}")
+                    logger.info(f"跳過已處理的URL: {url}")
+                    return
+
+                # 編碼參數已變更：重新下載轉碼並覆蓋原文件
+                logger.info(f"編碼參數已變更，重新轉碼: {recorded_path}")
+                output_path = recorded_path
+                claimed = self._claim_output_path(output_path)
+                if not claimed:
+                    return
+
+            elif self._probe_before_download:
+                # 沒有處理記錄且下載目錄中有舊文件時，先獲取元數據確定輸出文件，檢查是否已下載過
+                async with sem_dl:
+                    metadata = await self._get_metadata(url)
+
+                if metadata:
+                    output_path = await self._resolve_output_path(url, media_type, metadata)
+
+                    if await self.is_already_processed(url, output_path):
+                        logger.info(f"跳過已處理的URL: {url}")
+                        return
+
+                    # 標記後其他解析到同一文件的鏈接會跳過，直到本次下載完成並加入目錄索引
+                    claimed = self._claim_output_path(output_path)
+                    if not claimed:
+                        return
+
+            # 下載並轉碼（同時佔用網絡和 ffmpeg 名額，按固定順序獲取避免死鎖）
+            async with sem_dl, sem_ff:
+                output_file = await self.download_media(
+                    url, media_type, output_path, metadata.get('ext') if metadata else None
+                )
+
+            if not output_file:
+                logger.error(f"下載失敗，跳過: {url}")
+                return
+
+            logger.info(f"成功處理: {url}")
+
+        except Exception as e:
+            logger.error(f"處理鏈接時發生錯誤 {url}: {e}")
+
+        finally:
+            if claimed:
+                self._in_flight.discard(output_path)
+
+    async def process_download_list_async(self) -> None:
+        """並行處理下載列表中的所有鏈接"""
         if not self.download_list_path.exists():
             logger.error(f"下載列表文件不存在: {self.download_list_path}")
             return
 
+        # 讀取鏈接並去重（規範化後相同的鏈接只處理一次）
+        seen = set()
+        urls = []
         with open(self.download_list_path, 'r', encoding='utf-8') as f:
-            urls = [line.strip() for line in f if line.strip() and not line.strip().startswith('#')]
+            for line in f:
+                url = line.strip()
+                if not url or url.startswith('#'):
+                    continue
+                url = self.normalize_url(url)
+                if url not in seen:
+                    seen.add(url)
+                    urls.append(url)
 
         if not urls:
             logger.warning("下載列表為空")
@@ -409,59 +920,54 @@ class MediaDownloader:
 
         logger.info(f"找到 {len(urls)} 個下載鏈接")
 
-        for url in urls:
-            try:
-                logger.info(f"處理鏈接: {url}")
-
-                # 檢測媒體類型
-                media_type = self.detect_media_type(url)
-                logger.info(f"檢測到媒體類型: {media_type}")
+        # 只有存在沒有處理記錄的舊文件（例如舊版本下載的文件）時，才需要在下載前獲取元數據；
+        # 否則每個鏈接只訪問一次網絡，下載後根據元數據確定文件名
+        unrecorded = await asyncio.to_thread(self._scan_download_dir)
+        self._probe_before_download = unrecorded > 0
+        if unrecorded:
+            logger.info(f"發現 {unrecorded} 個沒有處理記錄的已下載文件，下載前先獲取元數據檢查")
 
-                # 獲取頻道名稱
-                channel_name = self.get_channel_name(url, media_type)
-                logger.info(f"頻道名稱: {channel_name}")
+        # 下載受網絡限制，轉碼受 CPU 限制，分別控制並行數量
+        sem_dl = asyncio.Semaphore(self.max_concurrent_downloads)
+        sem_ff = asyncio.Semaphore(self.max_concurrent_transcodes)
 
-                # 創建下載目錄
-                download_path = self.create_download_directory(channel_name)
-                logger.info(f"下載目錄: {download_path}")
-
-                # 檢查是否已經處理過（去重機制）
-                if self.is_already_processed(url, download_path):
-                    logger.info(f"跳過已處理的URL: {url}")
-                    continue
-
-                # 下載媒體
-                downloaded_file = self.download_media(url, download_path)
-                if not downloaded_file:
-                    logger.error(f"下載失敗，跳過: {url}")
-                    continue
+        await asyncio.gather(*(self._process_one(url, sem_dl, sem_ff) for url in urls))
 
-                # 轉換音頻格式
-                input_path = Path(downloaded_file)
-                output_path = input_path.with_stem(f"{input_path.stem}_processed").with_suffix('.mp3')
+    def process_download_list(self) -> None:
+        """處理下載列表中的所有鏈接"""
+        asyncio.run(self.process_download_list_async())
 
-                if self.convert_audio_format(str(input_path), str(output_path)):
-                    # 刪除原始文件
-                    input_path.unlink()
-                    logger.info(f"已刪除原始文件: {input_path}")
-                else:
-                    logger.warning(f"音頻轉換失敗，保留原始文件: {downloaded_file}")
+    def cleanup_empty_directories(self) -> None:
+        """清理空的目錄"""
+        self._remove_empty_dirs(str(self.download_dir))
 
-                logger.info(f"成功處理: {url}")
+    def _remove_empty_dirs(self, path: str) -> bool:
+        """
+        以後序遍歷刪除空目錄（子目錄刪除後父目錄變空也會一併刪除）
 
-            except Exception as e:
-                logger.error(f"處理鏈接時發生錯誤 {url}: {e}")
-                continue
+        Args:
+            path: 目錄路徑
 
-    def cleanup_empty_directories(self) -> None:
-        """清理空的目錄"""
-        for dir_path in self.download_dir.rglob('*'):
-            if dir_path.is_dir() and not any(dir_path.iterdir()):
-                try:
-                    dir_path.rmdir()
-                    logger.info(f"刪除空目錄: {dir_path}")
-                except Exception as e:
-                    logger.warning(f"無法刪除空目錄 {dir_path}: {e}")
+        Returns:
+            如果清理後該目錄為空則返回True
+        """
+        empty = True
+        try:
+            with os.scandir(path) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False) and self._remove_empty_dirs(entry.path):
+                        try:
+                            os.rmdir(entry.path)
+                            logger.info(f"刪除空目錄: {entry.path}")
+                            continue
+                        except Exception as e:
+                            logger.warning(f"無法刪除空目錄 {entry.path}: {e}")
+                    empty = False
+        except OSError as e:
+            # 無法讀取的目錄視為非空，不影響其他目錄的清理
+            logger.warning(f"無法讀取目錄 {path}: {e}")
+            return False
+        return empty
 
 def main():
     """主函數"""
@@ -502,5 +1008,6 @@ def main():
         logger.error(f"程序執行錯誤: {e}")
         print(f"錯誤: {e}")
 
+
 if __name__ == "__main__":
     main()
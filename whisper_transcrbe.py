@@ -23,9 +23,14 @@ Whisper 音頻轉錄器 - 獨立的音頻轉錄工具
 
 import os
 import json
+import asyncio
 import logging
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from pathlib import Path
-from typing import List, Optional
+from typing import List, Optional, Iterator
+
+import numpy as np
 
 # 配置日誌
 logging.basicConfig(
@@ -38,6 +43,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# mlx_whisper 模塊（延遲導入，每個進程只導入一次）
+_WHISPER = None
+
+
+def _get_whisper():
+    """
+    獲取 mlx_whisper 模塊，首次調用時導入
+
+    Returns:
+        mlx_whisper 模塊
+
+    Raises:
+        ImportError: mlx_whisper 未安裝
+    """
+    global _WHISPER
+    if _WHISPER is None:
+        try:
+            import mlx_whisper
+        except ImportError:
+            raise ImportError("mlx_whisper 模塊未安裝，請先安裝: pip install mlx-whisper")
+        _WHISPER = mlx_whisper
+    return _WHISPER
+
+
+def _clear_mlx_cache() -> None:
+    """釋放 MLX 在轉錄過程中緩存的顯存（模型權重不受影響）"""
+    try:
+        import mlx.core as mx
+        if hasattr(mx, 'clear_cache'):
+            mx.clear_cache()
+        else:
+            mx.metal.clear_cache()
+    except Exception as e:
+        logger.warning(f"清理 MLX 緩存失敗: {e}")
+
+
+def _init_worker(model_repo: str, use_fp16: bool) -> None:
+    """
+    轉錄子進程初始化：預先載入 Whisper 模型
+
+    mlx_whisper.transcribe 透過 ModelHolder 緩存最近使用的模型，
+    子進程啟動時載入一次，之後每次轉錄直接複用已載入的權重。
+
+    Args:
+        model_repo: 模型路徑或 Hugging Face 倉庫名
+        use_fp16: 是否使用半精度（需與轉錄設定一致才能命中緩存）
+    """
+    import mlx.core as mx
+    from mlx_whisper.transcribe import ModelHolder
+
+    logger.info(f"載入模型: {model_repo}")
+    ModelHolder.get_model(model_repo, mx.float16 if use_fp16 else mx.float32)
+
+
+def _transcribe_worker(pcm: bytes, model_repo: str, config: dict) -> dict:
+    """
+    在子進程中轉錄單個音頻
+
+    Args:
+        pcm: 16 kHz 單聲道 16-bit PCM 音頻數據
+        model_repo: 模型路徑或 Hugging Face 倉庫名
+        config: 轉錄參數
+
+    Returns:
+        轉錄結果字典
+    """
+    whisper = _get_whisper()
+
+    try:
+        # 與 mlx_whisper.load_audio 的轉換方式一致：int16 → [-1, 1) 的 float32
+        audio = np.frombuffer(pcm, dtype=np.int16).astype(np.float32) / 32768.0
+        return whisper.transcribe(audio, path_or_hf_repo=model_repo, **config)
+    finally:
+        # 釋放本次轉錄的中間緩存，避免顯存隨文件數增長
+        _clear_mlx_cache()
+
+
 class WhisperTranscriber:
     """Whisper 音頻轉錄器類"""
 
@@ -51,8 +133,16 @@ class WhisperTranscriber:
         self.audio_dir = Path(audio_dir)
         self.audio_dir.mkdir(exist_ok=True)
 
+        # 提前導入 mlx_whisper，缺少依賴時在啟動時報告而非每個文件轉錄時
+        try:
+            _get_whisper()
+        except ImportError as e:
+            logger.error(str(e))
+
         # 支援的音頻格式
         self.audio_extensions = {'.mp3', '.wav', '.m4a', '.flac', '.aac', '.ogg', '.webm', '.m4v'}
+        # 不帶點的擴展名集合，掃描時直接匹配文件名
+        self._exts_no_dot = frozenset(ext.lstrip('.') for ext in self.audio_extensions)
 
         # Whisper 模型設定
         self.model_repo = "mlx-community/whisper-large-v3-turbo"
@@ -81,15 +171,39 @@ class WhisperTranscriber:
         """
         audio_files = []
 
-        # 遞歸遍歷所有文件
-        for file_path in self.audio_dir.rglob('*'):
-            if (file_path.is_file() and
-                file_path.suffix.lower() in self.audio_extensions and
-                not file_path.name.startswith('.')):  # 過濾隱藏文件
-                audio_files.append(file_path)
+        # 遞歸遍歷所有文件，只為符合條件的文件構造 Path
+        for entry in self._walk(self.audio_dir):
+            name = entry.name
+            if (not name.startswith('.') and  # 過濾隱藏文件
+                '.' in name and
+                name.rpartition('.')[2].lower() in self._exts_no_dot):
+                audio_files.append(Path(entry.path))
 
         return audio_files
 
+    @staticmethod
+    def _walk(root: Path) -> Iterator[os.DirEntry]:
+        """
+        使用 os.scandir 遞歸遍歷目錄（利用 DirEntry 緩存的文件類型，減少系統調用）
+
+        Args:
+            root: 根目錄
+
+        Returns:
+            所有普通文件的 DirEntry 迭代器
+        """
+        stack = [str(root)]
+        while stack:
+            try:
+                with os.scandir(stack.pop()) as it:
+                    for entry in it:
+                        if entry.is_dir(follow_symlinks=False):
+                            stack.append(entry.path)
+                        elif entry.is_file(follow_symlinks=False):
+                            yield entry
+            except OSError as e:
+                logger.warning(f"無法讀取目錄: {e}")
+
     def get_transcript_path(self, audio_path: Path) -> Path:
         """
         獲取轉錄文件路徑
@@ -115,45 +229,77 @@ class WhisperTranscriber:
         transcript_path = self.get_transcript_path(audio_path)
         return not transcript_path.exists()
 
-    def transcribe_audio(self, audio_path: Path) -> Optional[dict]:
+    async def load_audio(self, audio_path: Path) -> Optional[bytes]:
+        """
+        使用 ffmpeg 將音頻解碼為 Whisper 所需的 16 kHz 單聲道 16-bit PCM
+
+        Args:
+            audio_path: 音頻文件路徑
+
+        Returns:
+            PCM 音頻數據，如果失敗則返回 None
+        """
+        try:
+            cmd = [
+                'ffmpeg',
+                '-nostdin',
+                '-i', str(audio_path),
+                '-f', 's16le',  # 16-bit PCM
+                '-ac', '1',  # 單聲道
+                '-ar', '16000',  # Whisper 要求 16 kHz
+                '-loglevel', 'error',
+                'pipe:1'
+            ]
+
+            process = await asyncio.create_subprocess_exec(
+                *cmd,
+                stdin=asyncio.subprocess.DEVNULL,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            pcm, stderr = await process.communicate()
+
+            if process.returncode != 0:
+                logger.error(f"音頻解碼失敗 {audio_path}: {stderr.decode('utf-8', 'replace').strip()}")
+                return None
+
+            return pcm
+
+        except Exception as e:
+            logger.error(f"音頻解碼失敗 {audio_path}: {e}")
+            return None
+
+    async def transcribe_audio(self, audio_path: Path, pcm: bytes, executor: Executor) -> Optional[dict]:
         """
-        轉錄單個音頻文件
+        轉錄單個音頻文件（在轉錄子進程中執行）
 
         Args:
             audio_path: 音頻文件路徑
+            pcm: 已解碼的 PCM 音頻數據
+            executor: 轉錄子進程池
 
         Returns:
             轉錄結果字典，如果失敗則返回 None
+
+        Raises:
+            BrokenProcessPool: 轉錄子進程異常退出（例如模型載入失敗）
         """
         try:
             logger.info(f"開始轉錄: {audio_path}")
 
-            # 動態導入 MLX Whisper
-            try:
-                import mlx_whisper as whisper
-            except ImportError:
-                raise ImportError("mlx_whisper 模塊未安裝，請先安裝: pip install mlx-whisper")
-
-            # 使用 MLX Whisper 進行轉錄
-            # 方式1: 直接參數傳遞 (原先方式)
-            # result = whisper.transcribe(
-            #     str(audio_path),
-            #     path_or_hf_repo=self.model_repo,
-            #     temperature=0.0,
-            #     task="transcribe",
-            #     verbose=False
-            # )
-
-            # 方式2: 使用配置字典展開 (當前方式)
-            result = whisper.transcribe(
-                str(audio_path),
-                path_or_hf_repo=self.model_repo,
-                **self.transcribe_config
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(
+                executor, _transcribe_worker,
+                pcm, self.model_repo, self.transcribe_config
             )
 
             logger.info(f"轉錄完成: {audio_path}")
             return result
 
+        except BrokenProcessPool:
+            # 子進程已不可用，後續文件都無法轉錄，交由調用者停止處理
+            raise
+
         except Exception as e:
             logger.error(f"轉錄失敗 {audio_path}: {e}")
             return None
@@ -172,33 +318,40 @@ class WhisperTranscriber:
         try:
             transcript_path = self.get_transcript_path(audio_path)
 
-            # 準備保存的內容
-            transcript_content = f"音頻文件: {audio_path.name}\n"
-            transcript_content += f"檢測語言: {result.get('language', '未知')}\n"
-            transcript_content += f"轉錄時間: {result.get('processing_time', '未知')}\n\n"
+            # 準備保存的內容（先收集各部分，最後一次性拼接寫入）
+            parts = [
+                f"音頻文件: {audio_path.name}\n",
+                f"檢測語言: {result.get('language', '未知')}\n",
+                f"轉錄時間: {result.get('processing_time', '未知')}\n\n"
+            ]
 
             # 添加完整文本
             text = result.get('text', '').strip()
-            transcript_content += f"完整文本:\n{text}\n\n"
+            parts.append(f"完整文本:\n{text}\n\n")
 
             # 添加分段信息（如果有）
             segments = result.get('segments', [])
             if segments:
-                transcript_content += "詳細分段:\n"
-                for i, segment in enumerate(segments, 1):
-                    start_time = segment.get('start', 0)
-                    end_time = segment.get('end', 0)
-                    segment_text = segment.get('text', '').strip()
-
-                    # 格式化時間
-                    start_str = f"{int(start_time)//60:02d}:{int(start_time)%60:02d}"
-                    end_str = f"{int(end_time)//60:02d}:{int(end_time)%60:02d}"
-
-                    transcript_content += f"[{start_str} - {end_str}] {segment_text}\n"
+                parts.append("詳細分段:\n")
+
+                # 向量化計算所有分段的分、秒（截斷為整數秒，與 int() 一致）
+                count = len(segments)
+                starts = np.fromiter((seg.get('start', 0) for seg in segments), dtype=np.float64, count=count)
+                ends = np.fromiter((seg.get('end', 0) for seg in segments), dtype=np.float64, count=count)
+                start_min, start_sec = np.divmod(starts.astype(np.int64), 60)
+                end_min, end_sec = np.divmod(ends.astype(np.int64), 60)
+
+                parts.extend(
+                    f"[{sm:02d}:{ss:02d} - {em:02d}:{es:02d}] {seg.get('text', '').strip()}\n"
+                    for sm, ss, em, es, seg in zip(
+                        start_min.tolist(), start_sec.tolist(),
+                        end_min.tolist(), end_sec.tolist(), segments
+                    )
+                )
 
             # 寫入文件
             with open(transcript_path, 'w', encoding='utf-8') as f:
-                f.write(transcript_content)
+                f.write(''.join(parts))
 
             logger.info(f"轉錄結果已保存: {transcript_path}")
             return True
@@ -269,6 +422,15 @@ class WhisperTranscriber:
 
     def process_all_audio_files(self) -> None:
         """處理所有音頻文件"""
+        asyncio.run(self.process_all_audio_files_async())
+
+    async def process_all_audio_files_async(self) -> None:
+        """
+        處理所有音頻文件
+
+        轉錄在單個子進程中依次進行（GPU 同一時間只能執行一個轉錄），
+        上一個文件的結果保存與下一個文件的轉錄同時進行。
+        """
         logger.info("開始掃描音頻文件...")
 
         # 查找所有音頻文件
@@ -283,33 +445,67 @@ class WhisperTranscriber:
         processed_count = 0
         skipped_count = 0
 
-        # 處理每個音頻文件
+        # 檢查是否需要轉錄
+        pending_files = []
         for audio_path in audio_files:
-            try:
-                logger.info(f"處理文件: {audio_path}")
-
-                # 檢查是否需要轉錄
-                if not self.needs_transcription(audio_path):
-                    logger.info(f"跳過已轉錄的文件: {audio_path}")
-                    skipped_count += 1
-                    continue
-
-                # 進行轉錄
-                result = self.transcribe_audio(audio_path)
-                if not result:
-                    logger.error(f"轉錄失敗，跳過: {audio_path}")
-                    continue
-
-                # 保存結果
-                if self.save_transcript(audio_path, result):
-                    processed_count += 1
-                    logger.info(f"成功處理: {audio_path}")
-                else:
-                    logger.error(f"保存失敗: {audio_path}")
+            if self.needs_transcription(audio_path):
+                pending_files.append(audio_path)
+            else:
+                logger.info(f"跳過已轉錄的文件: {audio_path}")
+                skipped_count += 1
+
+        async def save(audio_path: Path, result: dict) -> bool:
+            """在線程中保存轉錄結果"""
+            if await asyncio.to_thread(self.save_transcript, audio_path, result):
+                logger.info(f"成功處理: {audio_path}")
+                return True
+            logger.error(f"保存失敗: {audio_path}")
+            return False
 
-            except Exception as e:
-                logger.error(f"處理文件時發生錯誤 {audio_path}: {e}")
-                continue
+        if pending_files:
+            # 子進程啟動時只載入一次模型，所有文件共用
+            use_fp16 = self.transcribe_config.get('fp16', True)
+            with ProcessPoolExecutor(max_workers=1, initializer=_init_worker,
+                                     initargs=(self.model_repo, use_fp16)) as executor:
+                save_task = None
+                decode_task = asyncio.create_task(self.load_audio(pending_files[0]))
+
+                # 處理每個音頻文件
+                for i, audio_path in enumerate(pending_files):
+                    logger.info(f"處理文件: {audio_path}")
+
+                    pcm = await decode_task
+
+                    # 轉錄當前文件時預先解碼下一個文件
+                    if i + 1 < len(pending_files):
+                        decode_task = asyncio.create_task(self.load_audio(pending_files[i + 1]))
+
+                    # 進行轉錄（上一個文件的保存任務同時進行）
+                    result = None
+                    if pcm is not None:
+                        try:
+                            result = await self.transcribe_audio(audio_path, pcm, executor)
+                        except BrokenProcessPool as e:
+                            # 子進程初始化（載入模型）失敗或異常退出，後續提交都會失敗
+                            logger.error(f"轉錄子進程不可用，停止處理剩餘 {len(pending_files) - i} 個文件: {e}")
+                            decode_task.cancel()
+                            break
+                    del pcm
+
+                    if save_task is not None:
+                        if await save_task:
+                            processed_count += 1
+                        save_task = None
+
+                    if not result:
+                        logger.error(f"轉錄失敗，跳過: {audio_path}")
+                        continue
+
+                    # 保存結果
+                    save_task = asyncio.create_task(save(audio_path, result))
+
+                if save_task is not None and await save_task:
+                    processed_count += 1
 
         # 總結報告
         logger.info(f"處理完成! 新轉錄: {processed_count} 個, 跳過: {skipped_count} 個")
@@ -321,7 +517,7 @@ def main():
 
     # 檢查依賴
     try:
-        import mlx_whisper
+        _get_whisper()
         print("✓ mlx_whisper 模塊檢查通過")
     except ImportError:
         print("❌ 錯誤：缺少必要的依賴 mlx_whisper")